@@ -12,12 +12,22 @@ Este sistema permite:
 6. Generar respuestas contextualizadas
 """
 
+import asyncio
+import atexit
+import importlib.util
 import os
 import sys
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
 import json
+import re
+import threading
 import time
+import uuid
 
 # Librerías principales
 try:
@@ -28,15 +38,34 @@ try:
     from langchain.schema import Document
     from langchain.text_splitter import RecursiveCharacterTextSplitter
     from langchain.chains import RetrievalQA
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.vectorstores import VectorStore
     from langchain_community.document_loaders import PyPDFLoader, TextLoader
+    from langchain_community.vectorstores.utils import maximal_marginal_relevance
     import chromadb
+    from chromadb.config import Settings
+    import httpx
     from tqdm import tqdm
+    import numpy as np
+    import tiktoken
 except ImportError as e:
     print(f"Error importando librerías: {e}")
     print("Instala las dependencias con:")
-    print("pip install openai langchain langchain-openai langchain-chroma chromadb pypdf python-dotenv tqdm")
+    print("pip install openai langchain langchain-openai langchain-chroma chromadb pypdf python-dotenv tqdm numpy tiktoken")
     sys.exit(1)
 
+# Serialización JSON acelerada (opcional)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Event loop acelerado para las consultas asíncronas (opcional, no disponible en Windows)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 class DocumentProcessor:
     """Procesador de documentos para extraer y limpiar texto"""
 
@@ -52,143 +81,1075 @@ class DocumentProcessor:
             Lista de documentos procesados
         """
         documents = []
-        dir_path = Path(directory_path)
-        # Buscar todos los .txt y .pdf en el directorio
-        file_paths = list(dir_path.glob("*.txt")) + list(dir_path.glob("*.pdf"))
+        file_paths = DocumentProcessor._find_files(directory_path)
 
-        for file_path in file_paths:
-            file_path_str = str(file_path)
-            try:
-                if file_path_str.endswith('.pdf'):
-                    loader = PyPDFLoader(file_path_str)
-                    docs = loader.load()
-                    print(f"✅ Cargado PDF: {file_path_str} ({len(docs)} páginas)")
+        if not file_paths:
+            return documents
 
-                elif file_path_str.endswith('.txt'):
-                    loader = TextLoader(file_path_str, encoding='utf-8')
-                    docs = loader.load()
-                    print(f"✅ Cargado TXT: {file_path_str}")
+        # Cargar los archivos en paralelo conservando el orden original
+        with ThreadPoolExecutor(max_workers=min(8, len(file_paths))) as executor:
+            for docs in executor.map(DocumentProcessor._load_file, file_paths):
+                documents.extend(docs)
 
-                else:
-                    print(f"❌ Formato no soportado: {file_path_str}")
-                    continue
+        return documents
 
-                # Agregar metadatos adicionales
-                for doc in docs:
-                    doc.metadata['source_file'] = os.path.basename(file_path_str)
-                    doc.metadata['file_type'] = file_path_str.split('.')[-1]
+    @staticmethod
+    def iter_documents_from_directory(directory_path: str) -> Iterator[Document]:
+        """
+        Genera los documentos de un directorio página a página, sin cargar
+        cada archivo completo en memoria
 
-                documents.extend(docs)
+        Args:
+            directory_path: Ruta al directorio que contiene los archivos
 
+        Yields:
+            Documentos (páginas en el caso de PDF) a medida que se extraen
+        """
+        for file_path in DocumentProcessor._find_files(directory_path):
+            try:
+                yield from DocumentProcessor._iter_file(file_path)
             except Exception as e:
-                print(f"❌ Error cargando {file_path_str}: {e}")
+                print(f"❌ Error cargando {file_path}: {e}")
 
-        return documents
+    @staticmethod
+    def _find_files(directory_path: str) -> List[Path]:
+        """
+        Busca todos los .txt y .pdf en el directorio con un único recorrido, en orden
+        alfabético (el orden de scandir depende del sistema de archivos y con él
+        cambiaría la numeración de los fragmentos entre máquinas)
+        """
+        if not os.path.isdir(directory_path):
+            return []
+
+        with os.scandir(directory_path) as entries:
+            return sorted(
+                Path(entry.path) for entry in entries
+                if entry.name.lower().endswith(('.pdf', '.txt')) and entry.is_file()
+            )
+
+    @staticmethod
+    def _iter_file(file_path: Path) -> Iterator[Document]:
+        """
+        Extrae los documentos de un archivo PDF o TXT de forma perezosa
+
+        Args:
+            file_path: Ruta al archivo
+
+        Yields:
+            Documentos del archivo con metadatos adicionales
+        """
+        file_path_str = str(file_path)
+        file_type = Path(file_path_str).suffix.lower().lstrip('.')
+        if file_type == 'pdf':
+            loader = PyPDFLoader(file_path_str)
+        elif file_type == 'txt':
+            loader = TextLoader(file_path_str, encoding='utf-8')
+        else:
+            print(f"❌ Formato no soportado: {file_path_str}")
+            return
+
+        for doc in loader.lazy_load():
+            # Agregar metadatos adicionales
+            doc.metadata['source_file'] = os.path.basename(file_path_str)
+            doc.metadata['file_type'] = file_type
+            yield doc
+
+    @staticmethod
+    def _load_file(file_path: Path) -> List[Document]:
+        """
+        Carga un único archivo PDF o TXT
+
+        Args:
+            file_path: Ruta al archivo
+
+        Returns:
+            Lista de documentos del archivo (vacía si hubo un error)
+        """
+        file_path_str = str(file_path)
+        try:
+            docs = list(DocumentProcessor._iter_file(file_path))
+
+            file_type = Path(file_path_str).suffix.lower()
+            if file_type == '.pdf':
+                print(f"✅ Cargado PDF: {file_path_str} ({len(docs)} páginas)")
+            elif file_type == '.txt':
+                print(f"✅ Cargado TXT: {file_path_str}")
+
+            return docs
+
+        except Exception as e:
+            print(f"❌ Error cargando {file_path_str}: {e}")
+            return []
+
+@lru_cache(maxsize=None)
+def _get_splitter(chunk_size: int, chunk_overlap: int, length_unit: str) -> RecursiveCharacterTextSplitter:
+    """Devuelve un divisor compartido por todos los chunkers con la misma configuración"""
+    separators = ["\n\n", "\n", ".", "!", "?", ",", " ", ""]
+
+    if length_unit == "tokens":
+        # Longitud medida con el tokenizador de tiktoken (implementado en Rust)
+        return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name="cl100k_base",
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=separators
+        )
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=separators
+    )
 
 class TextChunker:
     """Divisor de texto en fragmentos manejables"""
 
-    def __init__(self, chunk_size: int = 1200, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1200, chunk_overlap: int = 200, length_unit: str = "chars"):
         """
         Inicializa el divisor de texto
 
         Args:
             chunk_size: Tamaño máximo de cada fragmento
             chunk_overlap: Solapamiento entre fragmentos
+            length_unit: Unidad de chunk_size y chunk_overlap ("chars" o "tokens")
         """
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
-        )
+        if length_unit not in ("chars", "tokens"):
+            raise ValueError(f"Unidad de longitud no soportada: {length_unit}")
+
+        self.splitter = _get_splitter(chunk_size, chunk_overlap, length_unit)
 
-    def split_documents(self, documents: List[Document]) -> List[Document]:
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
         """
         Divide documentos en fragmentos
 
         Args:
-            documents: Lista de documentos a dividir
+            documents: Documentos a dividir (lista o generador)
 
         Returns:
             Lista de fragmentos de documentos
         """
-        chunks = self.splitter.split_documents(documents)
-
-        # Agregar metadatos de fragmento
-        for i, chunk in enumerate(chunks):
-            chunk.metadata['chunk_id'] = i
-            chunk.metadata['chunk_size'] = len(chunk.page_content)
+        chunks = list(self.iter_chunks(documents))
 
         print(f"📄 Documentos divididos en {len(chunks)} fragmentos")
         return chunks
 
+    def iter_chunks(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """
+        Genera los fragmentos de cada documento a medida que llega
+
+        Args:
+            documents: Documentos a dividir (lista o generador)
+
+        Yields:
+            Fragmentos con metadatos de fragmento
+        """
+        chunk_id = 0
+        for document in documents:
+            for chunk in self.splitter.split_documents([document]):
+                # Agregar metadatos de fragmento (una sola actualización por fragmento);
+                # la vista previa se calcula una vez aquí y no en cada consulta
+                chunk.metadata.update(
+                    chunk_id=chunk_id,
+                    chunk_size=len(chunk.page_content),
+                    preview=chunk.page_content[:200]
+                )
+                chunk_id += 1
+                yield chunk
+
+def _write_json(path, data: Any, indent: bool = False):
+    """
+    Escribe datos como JSON en UTF-8, usando orjson si está instalado. Se escribe en un
+    archivo temporal que luego reemplaza al destino: una escritura interrumpida nunca
+    deja un JSON a medias
+    """
+    tmp_path = Path(f"{path}.tmp")
+    if orjson is not None:
+        tmp_path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0))
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2 if indent else None, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _run_async(coroutine):
+    """Ejecuta una corrutina en un event loop nuevo, con uvloop si está instalado"""
+    if uvloop is not None:
+        return uvloop.run(coroutine)
+    return asyncio.run(coroutine)
+
+class _LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte HTTP asíncrono con un pool de conexiones por event loop: las conexiones
+    de un pool quedan ligadas al loop que las abrió y no pueden reutilizarse en otro
+    """
+
+    def __init__(self, **transport_kwargs):
+        """
+        Inicializa el transporte
+
+        Args:
+            transport_kwargs: Argumentos de cada httpx.AsyncHTTPTransport (http2, limits, ...)
+        """
+        self._transport_kwargs = transport_kwargs
+        self._transports: Dict[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport] = {}
+
+    def _current_transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            # Los pools de loops ya cerrados no se pueden reutilizar ni cerrar
+            self._transports = {
+                other: pool for other, pool in self._transports.items() if not other.is_closed()
+            }
+            transport = self._transports[loop] = httpx.AsyncHTTPTransport(**self._transport_kwargs)
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current_transport().handle_async_request(request)
+
+    async def aclose(self):
+        """Cierra las conexiones abiertas desde el event loop actual"""
+        transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+def _normalize(vectors) -> np.ndarray:
+    """Normaliza vectores (o una matriz por filas) a norma L2 unitaria"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+class EmbeddingCache:
+    """Caché LRU con expiración (TTL) de embeddings de consultas"""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600):
+        """
+        Inicializa la caché
+
+        Args:
+            max_entries: Número máximo de consultas almacenadas
+            ttl_seconds: Tiempo de vida de cada entrada en segundos
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # clave -> (creación, embedding)
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(text: str) -> str:
+        """Clave SHA-256 del texto normalizado"""
+        return hashlib.sha256(text.strip().lower().encode("utf-8")).hexdigest()
+
+    def get_embedding(self, text: str) -> Optional[np.ndarray]:
+        """Devuelve el embedding almacenado para el texto, si existe y no ha expirado"""
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put_embedding(self, text: str, embedding: List[float]):
+        """Almacena el embedding de un texto desalojando la entrada menos usada"""
+        key = self._key(text)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), np.asarray(embedding, dtype=np.float32))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class ResponseCache:
+    """
+    Caché semántica de respuestas (pregunta -> respuesta) persistida en JSON.
+    Las respuestas nuevas se acumulan en memoria y se escriben con flush()
+    """
+
+    def __init__(self, path: Optional[str] = None, similarity_threshold: float = 0.95):
+        """
+        Inicializa la caché, cargando las respuestas persistidas si existen
+
+        Args:
+            path: Archivo JSON donde persistir la caché (None para solo memoria)
+            similarity_threshold: Similitud coseno mínima para reutilizar una respuesta
+        """
+        self.path = Path(path) if path else None
+        self.similarity_threshold = similarity_threshold
+        # Configuración con la que se generaron las respuestas (recuperador, etc.)
+        self.config: Optional[Dict[str, Any]] = None
+        self._embeddings: Optional[np.ndarray] = None
+        self._responses: List[Dict[str, Any]] = []
+        self._dirty = False
+        self._lock = threading.Lock()
+        # Serializa las escrituras para que una instantánea antigua no pise a una nueva
+        self._write_lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def _load(self):
+        """Carga las respuestas persistidas"""
+        if not self.path or not self.path.exists():
+            return
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+
+            # Formato anterior (lista de entradas sin configuración): se descarta
+            if not isinstance(stored, dict):
+                return
+
+            config = stored.get("config")
+            entries = stored.get("entries", [])
+            embeddings = _normalize([entry["embedding"] for entry in entries]) if entries else None
+            responses = [entry["response"] for entry in entries]
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Caché de respuestas ilegible ({e}), se empieza vacía")
+            return
+
+        self.config, self._embeddings, self._responses = config, embeddings, responses
+
+    def _save(self):
+        """Persiste una instantánea de las respuestas"""
+        if not self.path:
+            return
+
+        with self._write_lock:
+            with self._lock:
+                config, embeddings, responses = self.config, self._embeddings, self._responses
+                self._dirty = False
+
+            entries = []
+            if responses:
+                entries = [
+                    {"embedding": embedding.tolist(), "response": response}
+                    for embedding, response in zip(embeddings, responses)
+                ]
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _write_json(self.path, {"config": config, "entries": entries})
+
+    def flush(self):
+        """Persiste las respuestas agregadas desde la última escritura"""
+        if self._dirty:
+            self._save()
+
+    def lookup(self, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        Busca la respuesta de una pregunta semánticamente equivalente
+
+        Args:
+            embedding: Embedding de la nueva pregunta
+
+        Returns:
+            La respuesta de la pregunta más parecida si supera el umbral, o None
+        """
+        query_vector = _normalize(embedding)
+        with self._lock:
+            embeddings, responses = self._embeddings, self._responses
+
+        if not responses or embeddings.shape[1] != query_vector.shape[0]:
+            return None
+
+        # Los embeddings almacenados están normalizados: la similitud coseno
+        # contra todas las preguntas es un único producto matriz-vector
+        similarities = embeddings @ query_vector
+
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return responses[best]
+        return None
+
+    def add(self, embedding: List[float], response: Dict[str, Any]):
+        """Almacena la respuesta de una pregunta (en memoria hasta el próximo flush)"""
+        vector = _normalize(embedding)[np.newaxis, :]
+        with self._lock:
+            if self._responses and self._embeddings.shape[1] == vector.shape[1]:
+                self._embeddings = np.vstack([self._embeddings, vector])
+                self._responses = self._responses + [response]
+            else:
+                # Caché vacía o creada con otro modelo de embeddings
+                self._embeddings = vector
+                self._responses = [response]
+            self._dirty = True
+
+    def clear(self):
+        """Elimina todas las respuestas almacenadas"""
+        with self._lock:
+            self._embeddings = None
+            self._responses = []
+        self._save()
+
+    def configure(self, config: Dict[str, Any]) -> bool:
+        """
+        Fija la configuración con la que se generan las respuestas
+
+        Args:
+            config: Configuración serializable en JSON (p. ej. parámetros del recuperador)
+
+        Returns:
+            True si las respuestas almacenadas se descartaron por venir de otra configuración
+        """
+        with self._lock:
+            if config == self.config:
+                return False
+
+            discarded = bool(self._responses)
+            self.config = config
+            self._embeddings = None
+            self._responses = []
+        self._save()
+        return discarded
+
+class CachedEmbeddings(Embeddings):
+    """
+    Modelo de embeddings que reutiliza los embeddings de consultas repetidas
+    y devuelve todos los vectores normalizados (similitud coseno = producto interno)
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        """
+        Inicializa el modelo con caché
+
+        Args:
+            embeddings: Modelo de embeddings subyacente
+            cache: Caché donde se almacenan los embeddings de consultas
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return _normalize(self.embeddings.embed_documents(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        cached = self.cache.get_embedding(text)
+        if cached is None:
+            cached = _normalize(self.embeddings.embed_query(text))
+            self.cache.put_embedding(text, cached)
+        return cached.tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return _normalize(await self.embeddings.aembed_documents(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        cached = self.cache.get_embedding(text)
+        if cached is None:
+            cached = _normalize(await self.embeddings.aembed_query(text))
+            self.cache.put_embedding(text, cached)
+        return cached.tolist()
+
+class FAISSVectorStore(VectorStore):
+    """Almacén vectorial de búsqueda exacta (producto interno) con FAISS"""
+
+    def __init__(self, embedding: Embeddings, dimensions: int, persist_directory: Optional[str] = None,
+                 quantize: bool = False, embedding_model: Optional[str] = None):
+        """
+        Inicializa el almacén, cargando el índice persistido si existe
+
+        Args:
+            embedding: Modelo de embeddings para las consultas
+            dimensions: Dimensiones de los embeddings
+            persist_directory: Directorio donde persistir el índice y los documentos
+            quantize: Si almacenar los vectores cuantizados a int8 (4 veces menos memoria)
+            embedding_model: Nombre del modelo de embeddings (el índice persistido solo
+                se reutiliza si se creó con el mismo modelo)
+        """
+        try:
+            import faiss
+        except ImportError as e:
+            raise ImportError("Para el backend FAISS instala: pip install faiss-cpu") from e
+
+        self._faiss = faiss
+        self._embedding = embedding
+        self.dimensions = dimensions
+        self.persist_directory = persist_directory
+        self.quantize = quantize
+        self.embedding_model = embedding_model
+        self.index = self._create_index()
+        self._ids: List[str] = []
+        self._docs: List[Document] = []
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _create_index(self):
+        """Crea un índice exacto vacío, en float32 o cuantizado a int8"""
+        if not self.quantize:
+            return self._faiss.IndexFlatIP(self.dimensions)
+
+        index = self._faiss.IndexScalarQuantizer(
+            self.dimensions,
+            self._faiss.ScalarQuantizer.QT_8bit_uniform,
+            self._faiss.METRIC_INNER_PRODUCT
+        )
+        # Los vectores normalizados tienen todas sus componentes en [-1, 1]: con ese rango
+        # fijo el cuantizador se entrena una sola vez y ningún lote posterior se recorta
+        bounds = np.vstack([
+            -np.ones(self.dimensions, dtype=np.float32),
+            np.ones(self.dimensions, dtype=np.float32)
+        ])
+        index.train(bounds)
+        return index
+
+    def _is_compatible_index(self, index) -> bool:
+        """Indica si un índice persistido tiene el tipo y la cuantización que se esperan"""
+        if not self.quantize:
+            return isinstance(index, self._faiss.IndexFlatIP)
+        return (isinstance(index, self._faiss.IndexScalarQuantizer)
+                and index.sq.qtype == self._faiss.ScalarQuantizer.QT_8bit_uniform)
+
+    def _paths(self) -> Tuple[Path, Path]:
+        directory = Path(self.persist_directory)
+        return directory / "faiss.index", directory / "faiss_docs.json"
+
+    def _load(self):
+        """Carga el índice y los documentos persistidos si son compatibles"""
+        if not self.persist_directory:
+            return
+
+        index_path, docs_path = self._paths()
+        if not (index_path.exists() and docs_path.exists()):
+            return
+
+        with open(docs_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+
+        # Vectores de otro modelo con las mismas dimensiones no son comparables
+        index = self._faiss.read_index(str(index_path))
+        if (stored.get("embedding_model") != self.embedding_model
+                or stored.get("dimensions") != self.dimensions
+                or index.d != self.dimensions
+                or not self._is_compatible_index(index)):
+            print(f"♻️ Índice FAISS incompatible ({stored.get('embedding_model')}, {index.d} dims, "
+                  f"{type(index).__name__}), reindexando...")
+            return
+
+        self.index = index
+        self._ids = stored["ids"]
+        self._docs = [
+            Document(page_content=content, metadata=metadata)
+            for content, metadata in zip(stored["contents"], stored["metadatas"])
+        ]
+
+    def _save(self):
+        """Persiste el índice y los documentos"""
+        if not self.persist_directory:
+            return
+
+        index_path, docs_path = self._paths()
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._faiss.write_index(self.index, str(index_path))
+
+        _write_json(docs_path, {
+            "embedding_model": self.embedding_model,
+            "dimensions": self.dimensions,
+            "ids": self._ids,
+            "contents": [doc.page_content for doc in self._docs],
+            "metadatas": [doc.metadata for doc in self._docs]
+        })
+
+    def add_embeddings(self, ids: List[str], texts: List[str], embeddings: List[List[float]],
+                       metadatas: List[dict]):
+        """
+        Agrega textos con embeddings precalculados
+
+        Args:
+            ids: Identificadores de los textos
+            texts: Contenido de los textos
+            embeddings: Embeddings de los textos
+            metadatas: Metadatos de los textos
+        """
+        # Copia explícita: normalize_L2 opera en el sitio y no debe modificar el arreglo del llamador
+        vectors = np.array(embeddings, dtype=np.float32)
+        self._faiss.normalize_L2(vectors)
+        self.index.add(vectors)
+
+        self._ids.extend(ids)
+        self._docs.extend(
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(texts, metadatas)
+        )
+        self._save()
+
+    def add_texts(self, texts, metadatas: Optional[List[dict]] = None, **kwargs) -> List[str]:
+        texts = list(texts)
+        ids = kwargs.get("ids") or [str(uuid.uuid4()) for _ in texts]
+        self.add_embeddings(ids, texts, self._embedding.embed_documents(texts), metadatas or [{} for _ in texts])
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   **kwargs) -> "FAISSVectorStore":
+        texts = list(texts)
+        embeddings = embedding.embed_documents(texts)
+        store = cls(embedding, len(embeddings[0]), kwargs.get("persist_directory"))
+        store.add_embeddings(
+            kwargs.get("ids") or [str(uuid.uuid4()) for _ in texts],
+            texts, embeddings, metadatas or [{} for _ in texts]
+        )
+        return store
+
+    def _search_by_vector(self, embedding: List[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Devuelve (puntuaciones, índices) de los k vectores más similares"""
+        if self.index.ntotal == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        # CachedEmbeddings ya entrega la consulta normalizada
+        query = np.asarray([embedding], dtype=np.float32)
+        scores, indices = self.index.search(query, min(k, self.index.ntotal))
+        return scores[0], indices[0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        scores, indices = self._search_by_vector(self._embedding.embed_query(query), k)
+        return [(self._docs[i], float(score)) for score, i in zip(scores, indices) if i != -1]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, **kwargs) -> List[Document]:
+        query_embedding = np.asarray(self._embedding.embed_query(query), dtype=np.float32)
+        _, indices = self._search_by_vector(query_embedding, fetch_k)
+        indices = [int(i) for i in indices if i != -1]
+        if not indices:
+            return []
+
+        candidates = self.index.reconstruct_batch(np.asarray(indices, dtype=np.int64))
+        selected = maximal_marginal_relevance(query_embedding, candidates, lambda_mult=lambda_mult, k=k)
+        return [self._docs[indices[i]] for i in selected]
+
+    def get_existing_ids(self, ids: List[str]) -> set:
+        """Devuelve los identificadores que ya están indexados"""
+        return set(ids).intersection(self._ids)
+
+    def get_metadatas(self, ids: List[str]) -> Dict[str, dict]:
+        """Devuelve los metadatos de los identificadores que ya están indexados"""
+        wanted = set(ids)
+        return {doc_id: doc.metadata for doc_id, doc in zip(self._ids, self._docs) if doc_id in wanted}
+
+    def get_ids(self) -> List[str]:
+        """Devuelve todos los identificadores indexados"""
+        return list(self._ids)
+
+    def update_metadatas(self, ids: List[str], metadatas: List[dict]):
+        """Reemplaza los metadatos de textos ya indexados (sin tocar sus vectores)"""
+        positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        for doc_id, metadata in zip(ids, metadatas):
+            i = positions[doc_id]
+            self._docs[i] = Document(page_content=self._docs[i].page_content, metadata=metadata)
+        self._save()
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        """Elimina los textos con los identificadores dados, reconstruyendo el índice"""
+        to_delete = set(ids or [])
+        keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in to_delete]
+        if len(keep) == len(self._ids):
+            return False
+
+        # Con el rango fijo, recodificar los vectores reconstruidos devuelve los mismos códigos
+        vectors = self.index.reconstruct_n(0, self.index.ntotal).reshape(-1, self.dimensions)
+        self.index = self._create_index()
+        if keep:
+            self.index.add(np.ascontiguousarray(vectors[keep]))
+        self._ids = [self._ids[i] for i in keep]
+        self._docs = [self._docs[i] for i in keep]
+        self._save()
+        return True
+
+    def reset(self):
+        """Elimina todos los vectores y documentos indexados"""
+        self.index = self._create_index()
+        self._ids = []
+        self._docs = []
+        self._save()
+
+    def get_all(self) -> Tuple[List[str], List[dict], np.ndarray]:
+        """Devuelve contenidos, metadatos y embeddings indexados como arreglos paralelos"""
+        return (
+            [doc.page_content for doc in self._docs],
+            [doc.metadata for doc in self._docs],
+            self.index.reconstruct_n(0, self.index.ntotal).reshape(-1, self.dimensions)
+        )
+
+    def _select_relevance_score_fn(self):
+        # El producto interno de vectores normalizados ya es una similitud coseno
+        return lambda score: score
+
 class RAGSystem:
     """Sistema RAG completo"""
 
-    def __init__(self, openai_api_key: str = None, persist_directory: str = "./chroma_db"):
+    # Instrucción agregada a cada consulta enviada a la cadena
+    QUERY_INSTRUCTION = " --- Responde concretamente, sin tanto choro"
+
+    # Configuración HNSW de la colección en Chroma: producto interno (embeddings ya
+    # normalizados) y un grafo ligero para corpus de menos de 1k fragmentos. Los valores
+    # por defecto de Chroma (M=16, construction_ef=100, search_ef=10) construyen de más
+    # y buscan de menos para este tamaño; search_ef=64 cubre de sobra fetch_k=20 de MMR
+    COLLECTION_METADATA = {
+        "hnsw:space": "ip",
+        "hnsw:M": 8,
+        "hnsw:construction_ef": 64,
+        "hnsw:search_ef": 64
+    }
+
+    # Por debajo de este número de fragmentos la búsqueda exacta (FAISS) supera a HNSW
+    # tanto en latencia como en tiempo de construcción, sin pérdida de recall
+    FAISS_MAX_VECTORS = 10000
+
+    def __init__(self, openai_api_key: str = None, persist_directory: str = "./chroma_db",
+                 semantic_cache: bool = False, semantic_threshold: float = 0.95,
+                 embedding_dimensions: int = 384,
+                 local_embeddings: bool = False, backend: str = "chroma",
+                 quantize_embeddings: bool = False):
         """
         Inicializa el sistema RAG
 
         Args:
             openai_api_key: Clave API de OpenAI
             persist_directory: Directorio para persistir la base de datos vectorial
+            semantic_cache: Si reutilizar respuestas de consultas semánticamente equivalentes
+                (opcional; se persiste en persist_directory/qa_cache.json)
+            semantic_threshold: Similitud coseno mínima para reutilizar una respuesta
+            embedding_dimensions: Dimensiones de los embeddings de OpenAI (truncado MRL)
+            local_embeddings: Si usar all-MiniLM-L6-v2 en local en lugar de OpenAI
+            backend: Base de datos vectorial ("chroma", "faiss" o "auto" según el tamaño del corpus)
+            quantize_embeddings: Si cuantizar los embeddings a int8 (solo backend FAISS)
         """
+        if backend not in ("chroma", "faiss", "auto"):
+            raise ValueError(f"Backend no soportado: {backend}")
+
         # Configurar OpenAI
         if openai_api_key:
             os.environ["OPENAI_API_KEY"] = openai_api_key
         elif not os.getenv("OPENAI_API_KEY"):
             raise ValueError("Se requiere OPENAI_API_KEY")
 
-        # Inicializar componentes
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small"
+        # Cliente HTTP asíncrono compartido por embeddings y LLM: reutiliza las conexiones
+        # entre peticiones y multiplexa sobre HTTP/2 si el paquete h2 está instalado. Cada
+        # event loop tiene su propio pool (ver run), así que el sistema admite varios
+        # asyncio.run sucesivos
+        self._http_transport = _LoopLocalTransport(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
         )
+        self.http_async_client = httpx.AsyncClient(transport=self._http_transport)
+
+        # Inicializar componentes
+        self.query_cache = EmbeddingCache()
+        self.response_cache = ResponseCache(
+            os.path.join(persist_directory, "qa_cache.json"),
+            similarity_threshold=semantic_threshold
+        ) if semantic_cache else None
+        if self.response_cache is not None:
+            # Las respuestas de consultas sueltas se persisten al salir
+            atexit.register(self.response_cache.flush)
+        if local_embeddings:
+            try:
+                from langchain_huggingface import HuggingFaceEmbeddings
+            except ImportError as e:
+                raise ImportError(
+                    "Para embeddings locales instala: pip install langchain-huggingface sentence-transformers"
+                ) from e
+            self.embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
+            base_embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model)
+            self.embedding_dimensions = 384
+        else:
+            self.embedding_model = "text-embedding-3-small"
+            base_embeddings = OpenAIEmbeddings(
+                model=self.embedding_model,
+                dimensions=embedding_dimensions,
+                http_async_client=self.http_async_client
+            )
+            self.embedding_dimensions = embedding_dimensions
+
+        self.embeddings = CachedEmbeddings(base_embeddings, self.query_cache)
 
         self.llm = ChatOpenAI(
             model="gpt-4o-mini",
             temperature=0,
-            max_tokens=2000
+            max_tokens=2000,
+            streaming=True,
+            http_async_client=self.http_async_client
         )
 
         self.persist_directory = persist_directory
+        self.local_embeddings = local_embeddings
+        self.backend = backend
+        self.quantize_embeddings = quantize_embeddings
+        self._chroma_client = None
         self.vectorstore = None
         self.retriever = None
         self.qa_chain = None
 
+        # Fragmentos indexados en arreglos paralelos para búsquedas por lotes
+        self._doc_contents: Optional[List[str]] = None
+        self._doc_metadatas: Optional[List[dict]] = None
+        self._doc_matrix: Optional[np.ndarray] = None
+
         # Inicializar procesadores
         self.doc_processor = DocumentProcessor()
         self.text_chunker = TextChunker()
 
-    def build_vectorstore(self, documents: List[Document]):
+    def build_vectorstore(self, documents: List[Document], force_rebuild: bool = False,
+                          prune: bool = True):
         """
-        Construye la base de datos vectorial
+        Construye la base de datos vectorial, indexando solo los fragmentos nuevos
 
         Args:
-            documents: Lista de documentos a indexar
+            documents: Lista de documentos a indexar (el corpus completo)
+            force_rebuild: Si descartar el índice persistido y reindexar todo
+            prune: Si eliminar los fragmentos indexados que ya no están en el corpus
+                (archivos editados o borrados); con un subconjunto del corpus se elimina el resto
         """
         print("🔧 Construyendo base de datos vectorial...")
+        self._doc_matrix = None
+
+        backend = self.backend
+        if backend == "auto":
+            backend = "faiss" if len(documents) < self.FAISS_MAX_VECTORS else "chroma"
 
         # Crear o cargar vectorstore
-        self.vectorstore = Chroma(
-            collection_name="rag_documents",
-            embedding_function=self.embeddings,
-            persist_directory=self.persist_directory
-        )
+        if backend == "faiss":
+            self.vectorstore = FAISSVectorStore(
+                self.embeddings,
+                self.embedding_dimensions,
+                persist_directory=self.persist_directory,
+                quantize=self.quantize_embeddings,
+                embedding_model=self.embedding_model
+            )
+        else:
+            # Cliente sin telemetría anónima (evita un evento por cada operación)
+            self._chroma_client = chromadb.PersistentClient(
+                path=self.persist_directory,
+                settings=Settings(anonymized_telemetry=False)
+            )
+            self.vectorstore = Chroma(
+                collection_name="rag_documents",
+                embedding_function=self.embeddings,
+                client=self._chroma_client,
+                collection_metadata=self._collection_metadata()
+            )
+            self._check_collection_compatibility()
+
+        if force_rebuild:
+            print("♻️ Reindexando desde cero...")
+            if isinstance(self.vectorstore, FAISSVectorStore):
+                self.vectorstore.reset()
+            else:
+                self.vectorstore.reset_collection()
+            self._clear_response_cache()
+
+        if not documents:
+            print("⚠️ No hay documentos para indexar")
+            return
 
-        # Agregar documentos en lotes para evitar rate limits
-        batch_size = 100
+        # Identificar cada fragmento por el hash de su archivo y su contenido (un mismo texto
+        # en dos archivos se indexa dos veces, conservando cada source_file) y omitir los ya indexados
+        unique_documents = {}
+        for doc in documents:
+            key = f"{doc.metadata.get('source_file', '')}\0{doc.page_content}"
+            unique_documents.setdefault(hashlib.sha256(key.encode("utf-8")).hexdigest(), doc)
+
+        # Fragmentos de archivos editados o borrados
+        stale_ids = []
+        if prune:
+            stale_ids = [doc_id for doc_id in self._get_all_ids() if doc_id not in unique_documents]
+            if stale_ids:
+                self._delete_ids(stale_ids)
+
+        # Los fragmentos sin cambios conservan su embedding, pero su posición en el
+        # documento (chunk_id) y sus metadatos pueden haber cambiado
+        existing_metadatas = self._get_existing_metadatas(list(unique_documents))
+        outdated_ids = [
+            doc_id for doc_id, metadata in existing_metadatas.items()
+            if metadata != unique_documents[doc_id].metadata
+        ]
+        if outdated_ids:
+            self._update_metadatas(outdated_ids, [unique_documents[doc_id].metadata for doc_id in outdated_ids])
 
-        for i in tqdm(range(0, len(documents), batch_size), desc="Indexando documentos"):
-            batch = documents[i:i + batch_size]
-            try:
-                self.vectorstore.add_documents(batch)
-                time.sleep(1)  # Pausa para evitar rate limits
-            except Exception as e:
-                print(f"❌ Error en lote {i//batch_size + 1}: {e}")
-                time.sleep(5)  # Pausa más larga en caso de error
+        new_documents = {
+            doc_id: doc for doc_id, doc in unique_documents.items() if doc_id not in existing_metadatas
+        }
+
+        if not new_documents and not stale_ids:
+            print(f"✅ Base de datos vectorial al día ({len(existing_metadatas)} fragmentos ya indexados)")
+            return
+
+        ids = list(new_documents)
+        if ids:
+            self._add_documents(ids, list(new_documents.values()))
+
+        # Las respuestas almacenadas pueden quedar obsoletas con el nuevo contenido
+        self._clear_response_cache()
+
+        print(f"✅ Base de datos vectorial actualizada: {len(ids)} fragmentos nuevos, "
+              f"{len(stale_ids)} eliminados, {len(existing_metadatas)} ya indexados")
+
+    def _add_documents(self, ids: List[str], documents: List[Document]):
+        """Genera los embeddings de fragmentos nuevos y los escribe en la base de datos vectorial"""
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+
+        # Con OpenAI, lotes limitados por tokens (una petición por lote); el modelo local
+        # no tiene presupuesto de tokens por petición y basta con lotes de tamaño fijo
+        if self.local_embeddings:
+            batches = self._batch_by_count(texts)
+        else:
+            batches = self._batch_by_tokens(texts)
+
+        embeddings = []
+        for batch in tqdm(batches, desc="Generando embeddings"):
+            embeddings.extend(self._embed_with_retry(batch))
+
+        # Escritura única con embeddings precalculados (sin re-embeber en LangChain)
+        if isinstance(self.vectorstore, FAISSVectorStore):
+            self.vectorstore.add_embeddings(ids, texts, embeddings, metadatas)
+        else:
+            # Una escritura por lote máximo admitido por Chroma (una sola para corpus pequeños)
+            max_batch_size = self._chroma_client.get_max_batch_size()
+            for start in range(0, len(ids), max_batch_size):
+                end = start + max_batch_size
+                self.vectorstore._collection.add(
+                    ids=ids[start:end],
+                    embeddings=embeddings[start:end],
+                    documents=texts[start:end],
+                    metadatas=metadatas[start:end]
+                )
+
+    def _clear_response_cache(self):
+        """Descarta las respuestas en caché cuando cambia el contenido indexado"""
+        if self.response_cache is not None and len(self.response_cache):
+            print("🧹 Caché de respuestas invalidada")
+            self.response_cache.clear()
+
+    def _get_all_ids(self) -> List[str]:
+        """Devuelve todos los identificadores de la base de datos vectorial"""
+        if isinstance(self.vectorstore, FAISSVectorStore):
+            return self.vectorstore.get_ids()
+        return self.vectorstore._collection.get(include=[])["ids"]
+
+    def _get_existing_metadatas(self, ids: List[str]) -> Dict[str, dict]:
+        """Devuelve los metadatos de los identificadores que ya existen en la base de datos vectorial"""
+        if isinstance(self.vectorstore, FAISSVectorStore):
+            return self.vectorstore.get_metadatas(ids)
+        stored = self.vectorstore._collection.get(ids=ids, include=["metadatas"])
+        return dict(zip(stored["ids"], stored["metadatas"]))
+
+    def _delete_ids(self, ids: List[str]):
+        """Elimina fragmentos de la base de datos vectorial"""
+        if isinstance(self.vectorstore, FAISSVectorStore):
+            self.vectorstore.delete(ids)
+            return
+
+        max_batch_size = self._chroma_client.get_max_batch_size()
+        for start in range(0, len(ids), max_batch_size):
+            self.vectorstore._collection.delete(ids=ids[start:start + max_batch_size])
+
+    def _update_metadatas(self, ids: List[str], metadatas: List[dict]):
+        """Actualiza los metadatos de fragmentos ya indexados sin regenerar sus embeddings"""
+        if isinstance(self.vectorstore, FAISSVectorStore):
+            self.vectorstore.update_metadatas(ids, metadatas)
+            return
+
+        max_batch_size = self._chroma_client.get_max_batch_size()
+        for start in range(0, len(ids), max_batch_size):
+            end = start + max_batch_size
+            self.vectorstore._collection.update(ids=ids[start:end], metadatas=metadatas[start:end])
+
+    def _embedding_config(self) -> Dict[str, Any]:
+        """Identifica el espacio vectorial: modelo de embeddings y dimensiones"""
+        return {"embedding_model": self.embedding_model, "embedding_dimensions": self.embedding_dimensions}
+
+    def _collection_metadata(self) -> Dict[str, Any]:
+        """Metadatos de la colección en Chroma: configuración HNSW y modelo de embeddings"""
+        return {**self.COLLECTION_METADATA, **self._embedding_config()}
+
+    def _check_collection_compatibility(self):
+        """Reinicia la colección persistida si se creó con otros embeddings o configuración HNSW"""
+        stored_metadata = self.vectorstore._collection.metadata or {}
+        mismatched = [
+            key for key, value in self._collection_metadata().items() if stored_metadata.get(key) != value
+        ]
+
+        if mismatched:
+            print(f"♻️ Colección incompatible ({', '.join(mismatched)}), reindexando...")
+            self.vectorstore.reset_collection()
+            self._clear_response_cache()
+
+    @staticmethod
+    def _batch_by_tokens(texts: List[str], max_tokens: int = 8000,
+                         token_counts: Optional[List[int]] = None) -> List[List[str]]:
+        """
+        Agrupa textos en lotes cuyo total de tokens no supera el presupuesto
+
+        Args:
+            texts: Textos a agrupar
+            max_tokens: Máximo de tokens por lote
+            token_counts: Tokens de cada texto (por defecto se cuentan con el
+                tokenizador de text-embedding-3-small)
+
+        Returns:
+            Lista de lotes de textos
+        """
+        if token_counts is None:
+            encoding = tiktoken.encoding_for_model("text-embedding-3-small")
+            token_counts = [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+        batches, batch, batch_tokens = [], [], 0
+        for text, num_tokens in zip(texts, token_counts):
+            if batch and batch_tokens + num_tokens > max_tokens:
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += num_tokens
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def _batch_by_count(texts: List[str], batch_size: int = 256) -> List[List[str]]:
+        """
+        Agrupa textos en lotes de tamaño fijo
+
+        Args:
+            texts: Textos a agrupar
+            batch_size: Máximo de textos por lote
+
+        Returns:
+            Lista de lotes de textos
+        """
+        return [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+
+    def _embed_with_retry(self, texts: List[str], max_retries: int = 5) -> List[List[float]]:
+        """
+        Genera embeddings reintentando con espera exponencial ante rate limits
 
-        print(f"✅ Base de datos vectorial creada con {len(documents)} documentos")
+        Args:
+            texts: Textos a convertir en embeddings
+            max_retries: Número máximo de intentos
+
+        Returns:
+            Lista de embeddings
+        """
+        for attempt in range(max_retries):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except openai.RateLimitError:
+                if attempt == max_retries - 1:
+                    raise
+                wait = 2 ** attempt
+                print(f"⏳ Rate limit alcanzado, reintentando en {wait}s...")
+                time.sleep(wait)
 
     def setup_retriever(self, k: int = 5, search_type: str = "similarity"):
         """
@@ -201,11 +1162,18 @@ class RAGSystem:
         if not self.vectorstore:
             raise ValueError("Primero debe construir la base de datos vectorial")
 
+        search_kwargs = {"k": k, "fetch_k": 20, "lambda_mult": 0.5}
         self.retriever = self.vectorstore.as_retriever(
             search_type=search_type,
-            search_kwargs={"k": k, "fetch_k": 20,"lambda_mult": 0.5}
+            search_kwargs=search_kwargs
         )
 
+        # Las respuestas en caché solo valen para la misma configuración de recuperación
+        # y el mismo modelo de embeddings (las preguntas se comparan en su espacio vectorial)
+        if self.response_cache is not None and self.response_cache.configure(
+                {**self._embedding_config(), "search_type": search_type, **search_kwargs}):
+            print("🧹 Caché de respuestas invalidada (cambió el recuperador o los embeddings)")
+
         print(f"🔍 Recuperador configurado: {search_type}, k={k}")
 
     def setup_qa_chain(self):
@@ -239,38 +1207,162 @@ class RAGSystem:
 
         print(f"❓ Procesando consulta: {question}")
 
+        prompt = question + self.QUERY_INSTRUCTION
+
         try:
-            result = self.qa_chain.invoke({"query": question + " --- Responde concretamente, sin tanto choro"})
+            # Reutilizar la respuesta de una consulta equivalente ya procesada; se compara
+            # la pregunta sin la instrucción común, que inflaría la similitud entre preguntas
+            question_embedding = None
+            if self.response_cache is not None:
+                question_embedding = self.embeddings.embed_query(question)
+                cached = self._get_cached_response(question, question_embedding, return_sources)
+                if cached is not None:
+                    return cached
+
+            result = self.qa_chain.invoke({"query": prompt})
+            return self._build_response(question, result, return_sources, question_embedding)
 
-            response = {
-                "question": question,
-                "answer": result["result"],
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-            }
+        except Exception as e:
+            return self._build_error_response(question, e)
+
+    async def aquery(self, question: str, return_sources: bool = True,
+                     callbacks: Optional[list] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de query: no bloquea el event loop mientras espera al LLM
+
+        Args:
+            question: Pregunta del usuario
+            return_sources: Si incluir documentos fuente
+            callbacks: Callbacks de LangChain (p. ej. para recibir los tokens en streaming)
+
+        Returns:
+            Diccionario con respuesta y metadatos
+        """
+        if not self.qa_chain:
+            raise ValueError("Sistema no inicializado completamente")
+
+        print(f"❓ Procesando consulta: {question}")
 
-            if return_sources and "source_documents" in result:
-                sources = []
-                for i, doc in enumerate(result["source_documents"]):
-                    source_info = {
-                        "document_id": i + 1,
-                        "source_file": doc.metadata.get("source_file", "Unknown"),
-                        "chunk_id": doc.metadata.get("chunk_id", "Unknown"),
-                        "content_preview": doc.page_content[:200] + "..."
-                    }
-                    sources.append(source_info)
+        prompt = question + self.QUERY_INSTRUCTION
 
-                response["sources"] = sources
-                response["num_sources"] = len(sources)
+        try:
+            question_embedding = None
+            if self.response_cache is not None:
+                question_embedding = await self.embeddings.aembed_query(question)
+                cached = self._get_cached_response(question, question_embedding, return_sources)
+                if cached is not None:
+                    return cached
 
-            return response
+            result = await self.qa_chain.ainvoke({"query": prompt}, config={"callbacks": callbacks})
+            return self._build_response(question, result, return_sources, question_embedding)
 
         except Exception as e:
-            return {
-                "question": question,
-                "answer": f"Error procesando consulta: {e}",
-                "error": True,
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-            }
+            return self._build_error_response(question, e)
+
+    async def aclose_connections(self):
+        """Cierra las conexiones HTTP abiertas desde el event loop actual"""
+        await self._http_transport.aclose()
+
+    def run(self, coroutine):
+        """
+        Ejecuta una corrutina del sistema en un event loop nuevo y cierra sus conexiones al terminar
+
+        Args:
+            coroutine: Corrutina a ejecutar (p. ej. abatch_query)
+
+        Returns:
+            El resultado de la corrutina
+        """
+        async def run_and_close():
+            try:
+                return await coroutine
+            finally:
+                await self.aclose_connections()
+
+        return _run_async(run_and_close())
+
+    async def abatch_query(self, questions: List[str], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+        """
+        Procesa varias consultas de forma concurrente
+
+        Args:
+            questions: Preguntas del usuario
+            max_concurrency: Máximo de consultas simultáneas (para respetar rate limits)
+
+        Returns:
+            Respuestas en el mismo orden que las preguntas
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def limited_query(question: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.aquery(question)
+
+        results = await asyncio.gather(*(limited_query(question) for question in questions))
+
+        # Una sola escritura de la caché por lote, fuera del event loop
+        if self.response_cache is not None:
+            await asyncio.to_thread(self.response_cache.flush)
+        return results
+
+    def _get_cached_response(self, question: str, question_embedding: List[float],
+                             return_sources: bool) -> Optional[Dict[str, Any]]:
+        """Devuelve la respuesta en caché de una consulta equivalente, si existe"""
+        cached = self.response_cache.lookup(question_embedding)
+        if cached is None:
+            return None
+
+        print("⚡ Respuesta recuperada de la caché")
+        response = {
+            **cached,
+            "question": question,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "cache_hit": True
+        }
+        if not return_sources:
+            response.pop("sources", None)
+            response.pop("num_sources", None)
+        return response
+
+    def _build_response(self, question: str, result: Dict[str, Any], return_sources: bool,
+                        question_embedding: Optional[List[float]]) -> Dict[str, Any]:
+        """Construye la respuesta a partir del resultado de la cadena y la guarda en caché"""
+        response = {
+            "question": question,
+            "answer": result["result"],
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+        if return_sources and "source_documents" in result:
+            sources = []
+            for i, doc in enumerate(result["source_documents"]):
+                # Solo se recorta el contenido si el fragmento se indexó sin vista previa
+                preview = doc.metadata.get("preview")
+                if preview is None:
+                    preview = doc.page_content[:200]
+                source_info = {
+                    "document_id": i + 1,
+                    "source_file": doc.metadata.get("source_file", "Unknown"),
+                    "chunk_id": doc.metadata.get("chunk_id", "Unknown"),
+                    "content_preview": preview + "..."
+                }
+                sources.append(source_info)
+
+            response["sources"] = sources
+            response["num_sources"] = len(sources)
+            if question_embedding is not None:
+                self.response_cache.add(question_embedding, dict(response))
+
+        return response
+
+    @staticmethod
+    def _build_error_response(question: str, error: Exception) -> Dict[str, Any]:
+        return {
+            "question": question,
+            "answer": f"Error procesando consulta: {error}",
+            "error": True,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
 
     def search_similar_documents(self, query: str, k: int = 3) -> List[Dict]:
         """
@@ -281,23 +1373,73 @@ class RAGSystem:
             k: Número de documentos a retornar
 
         Returns:
-            Lista de documentos similares
+            Lista de documentos similares (similitud coseno, igual que batch_search_similar)
         """
         if not self.vectorstore:
             raise ValueError("Base de datos vectorial no inicializada")
 
         docs = self.vectorstore.similarity_search_with_score(query, k=k)
+        if not isinstance(self.vectorstore, FAISSVectorStore):
+            # Chroma con "ip" devuelve la distancia 1 - ip; FAISS ya devuelve la similitud
+            docs = [(doc, 1.0 - distance) for doc, distance in docs]
 
-        results = []
-        for doc, score in docs:
-            result = {
-                "content": doc.page_content,
-                "similarity_score": float(score),
-                "metadata": doc.metadata
-            }
-            results.append(result)
+        return [
+            {"content": doc.page_content, "similarity_score": float(score), "metadata": doc.metadata}
+            for doc, score in docs
+        ]
 
-        return results
+    def batch_search_similar(self, queries: List[str], k: int = 3) -> List[List[Dict]]:
+        """
+        Busca documentos similares para varias consultas a la vez
+
+        Args:
+            queries: Consultas de búsqueda
+            k: Número de documentos a retornar por consulta
+
+        Returns:
+            Lista con los documentos más similares de cada consulta (similitud coseno)
+        """
+        if not self.vectorstore:
+            raise ValueError("Base de datos vectorial no inicializada")
+
+        self._load_document_arrays()
+        k = min(k, len(self._doc_contents))
+        if not queries or k == 0:
+            return [[] for _ in queries]
+
+        # Un único embedding por lote y una única multiplicación de matrices (Q, d) x (d, N);
+        # con vectores normalizados el producto interno es la similitud coseno
+        query_matrix = np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32)
+        scores = query_matrix @ self._doc_matrix.T
+
+        # Top-k sin ordenar toda la fila, luego orden descendente solo de los k elegidos
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+        return [
+            [
+                {"content": self._doc_contents[j], "similarity_score": float(scores[q, j]),
+                 "metadata": self._doc_metadatas[j]}
+                for j in row
+            ]
+            for q, row in enumerate(top)
+        ]
+
+    def _load_document_arrays(self):
+        """Carga los fragmentos indexados como arreglos paralelos (contenido, metadatos, embeddings)"""
+        if self._doc_matrix is not None:
+            return
+
+        if isinstance(self.vectorstore, FAISSVectorStore):
+            contents, metadatas, matrix = self.vectorstore.get_all()
+        else:
+            stored = self.vectorstore._collection.get(include=["documents", "metadatas", "embeddings"])
+            contents, metadatas = stored["documents"], stored["metadatas"]
+            matrix = np.asarray(stored["embeddings"], dtype=np.float32).reshape(-1, self.embedding_dimensions)
+
+        self._doc_contents = contents
+        self._doc_metadatas = metadatas
+        self._doc_matrix = matrix
 
 def create_sample_documents():
     """Crea documentos de ejemplo si no existen archivos"""
@@ -459,9 +1601,14 @@ def main():
         # Inspeccionar chunks que contienen la frase clave
         print("\n🔍 Buscando chunks con 'VisionBox AI' y 'salud'...")
 
+        # Búsqueda sin distinguir mayúsculas sin crear una copia en minúsculas de cada chunk;
+        # se evalúa primero el término más raro para descartar antes
+        visionbox_pattern = re.compile(r"visionbox\s+ai", re.IGNORECASE)
+        salud_pattern = re.compile(r"salud", re.IGNORECASE)
+
         for i, chunk in enumerate(chunks):
-            content = chunk.page_content.lower()
-            if "visionbox ai" in content and "salud" in content:
+            content = chunk.page_content
+            if visionbox_pattern.search(content) and salud_pattern.search(content):
                 print(f"\n🧩 Chunk {i} — {chunk.metadata.get('source_file')}")
                 print(chunk.page_content)
                 print("-" * 80)
@@ -499,13 +1646,12 @@ def main():
             "¿Cuál fue el cliente del sector agroindustrial que adquirió dos productos de TechCorp en el primer semestre de 2025, y cuáles fueron esos productos?"
         ]
 
-        results = []
+        # Las consultas son independientes: se ejecutan de forma concurrente (máximo 8
+        # simultáneas para no exceder los rate limits) y conservan el orden original
+        results = rag_system.run(rag_system.abatch_query(test_questions, max_concurrency=8))
 
-        for i, question in enumerate(test_questions, 1):
+        for i, result in enumerate(results, 1):
             print(f"\n--- Consulta {i} ---")
-            result = rag_system.query(question)
-            results.append(result)
-
             print(f"❓ Pregunta: {result['question']}")
             print(f"✅ Respuesta: {result['answer']}")
 
@@ -518,8 +1664,7 @@ def main():
 
         # Guardar resultados
         results_file = "rag_results.json"
-        with open(results_file, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        _write_json(results_file, results, indent=True)
 
         print(f"\n💾 Resultados guardados en: {results_file}")
 
@@ -6,14 +6,23 @@ Valida el funcionamiento completo del sistema y genera métricas
 
 import os
 import sys
+import asyncio
 import json
 import time
+import tempfile
 import unittest
+import importlib.util
+from unittest import mock
 from pathlib import Path
 
 # Importar el sistema RAG
 try:
-    from RETO_RAG import RAGSystem, create_sample_documents
+    import numpy as np
+    from langchain_core.embeddings import Embeddings
+    from RETO_RAG import (
+        RAGSystem, DocumentProcessor, TextChunker, EmbeddingCache, ResponseCache, CachedEmbeddings,
+        FAISSVectorStore, create_sample_documents, _LoopLocalTransport
+    )
     from dotenv import load_dotenv
 except ImportError as e:
     print(f"❌ Error importando dependencias: {e}")
@@ -37,14 +46,25 @@ class TestRAGSystem(unittest.TestCase):
         # Crear documentos de ejemplo
         create_sample_documents()
 
-        # Inicializar sistema RAG
-        cls.rag_system = RAGSystem()
+        # Inicializar sistema RAG sobre un directorio temporal: los tests indexan
+        # subconjuntos del corpus y no deben podar el índice de ./chroma_db
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.rag_system = RAGSystem(persist_directory=cls.tmp_dir.name)
+
+        # Cargar y dividir los documentos una sola vez para todos los tests
+        cls.documents = cls.rag_system.doc_processor.load_documents_from_directory("sample_docs")
+        cls.chunks = cls.rag_system.text_chunker.split_documents(cls.documents)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Elimina el índice temporal"""
+        cls.tmp_dir.cleanup()
 
     def test_01_document_loading(self):
         """Test: Carga de documentos"""
         print("\n🧪 Test 1: Carga de documentos")
 
-        documents = self.rag_system.doc_processor.load_documents_from_directory("sample_docs")
+        documents = self.documents
 
         self.assertGreater(len(documents), 0, "No se cargaron documentos")
         self.assertTrue(all(doc.page_content for doc in documents), "Documentos vacíos")
@@ -55,8 +75,8 @@ class TestRAGSystem(unittest.TestCase):
         """Test: División en fragmentos"""
         print("\n🧪 Test 2: División en fragmentos")
 
-        documents = self.rag_system.doc_processor.load_documents_from_directory("sample_docs")
-        chunks = self.rag_system.text_chunker.split_documents(documents)
+        documents = self.documents
+        chunks = self.chunks
 
         self.assertGreater(len(chunks), len(documents), "No se dividieron los documentos")
         self.assertTrue(all(chunk.page_content for chunk in chunks), "Fragmentos vacíos")
@@ -67,8 +87,7 @@ class TestRAGSystem(unittest.TestCase):
         """Test: Creación de base de datos vectorial"""
         print("\n🧪 Test 3: Base de datos vectorial")
 
-        documents = self.rag_system.doc_processor.load_documents_from_directory("sample_docs")
-        chunks = self.rag_system.text_chunker.split_documents(documents)
+        chunks = self.chunks
 
         # Usar solo algunos fragmentos para el test (más rápido)
         test_chunks = chunks[:5]
@@ -146,6 +165,321 @@ class TestRAGSystem(unittest.TestCase):
 
         print(f"✅ {successful_queries}/{len(test_questions)} consultas exitosas ({success_rate:.1%})")
 
+    def test_08_batch_search(self):
+        """Test: Búsqueda por lotes"""
+        print("\n🧪 Test 8: Búsqueda por lotes")
+
+        if not hasattr(self.rag_system, 'vectorstore') or self.rag_system.vectorstore is None:
+            self.test_03_vectorstore_creation()
+
+        queries = ["vacaciones", "estándares de código"]
+        results = self.rag_system.batch_search_similar(queries, k=2)
+
+        self.assertEqual(len(results), len(queries), "Número de resultados incorrecto")
+        for docs in results:
+            self.assertGreater(len(docs), 0, "No se encontraron resultados")
+            scores = [doc["similarity_score"] for doc in docs]
+            self.assertEqual(scores, sorted(scores, reverse=True), "Resultados no ordenados")
+
+        print(f"✅ Búsqueda por lotes: {len(queries)} consultas en una sola llamada")
+
+    def test_14_incremental_rebuild(self):
+        """Test: Reconstrucción incremental de la base de datos vectorial"""
+        print("\n🧪 Test 14: Reconstrucción incremental")
+
+        test_chunks = self.chunks[:5]
+        self.rag_system.build_vectorstore(test_chunks)
+
+        # Mismo corpus: no se genera ningún embedding
+        with mock.patch.object(self.rag_system, "_embed_with_retry") as embed:
+            self.rag_system.build_vectorstore(test_chunks)
+            embed.assert_not_called()
+        self.assertEqual(self.rag_system.vectorstore._collection.count(), len(test_chunks))
+
+        # Fragmentos que ya no están en el corpus se eliminan
+        self.rag_system.build_vectorstore(test_chunks[:4])
+        self.assertEqual(self.rag_system.vectorstore._collection.count(), 4)
+
+        self.rag_system.build_vectorstore(test_chunks)
+        print("✅ Solo se indexan los fragmentos nuevos y se eliminan los obsoletos")
+
+
+class KeywordEmbeddings(Embeddings):
+    """Embeddings deterministas por conteo de palabras clave (tests sin API key)"""
+
+    VOCABULARY = ["vacaciones", "días", "código", "python"]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        words = text.lower().split()
+        return [float(words.count(term)) for term in self.VOCABULARY]
+
+
+class StubQAChain:
+    """Cadena QA asíncrona simulada: registra la concurrencia y falla a propósito"""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.active = 0
+        self.max_active = 0
+
+    async def ainvoke(self, inputs, config=None):
+        question = inputs["query"].replace(RAGSystem.QUERY_INSTRUCTION, "")
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delays.get(question, 0))
+            if "falla" in question:
+                raise RuntimeError("fallo simulado")
+            return {"result": f"respuesta a {question}", "source_documents": []}
+        finally:
+            self.active -= 1
+
+
+class TestRAGComponents(unittest.TestCase):
+    """Tests unitarios de componentes que no requieren API key"""
+
+    def test_07_query_cache(self):
+        """Test: Caché de embeddings de consultas"""
+        print("\n🧪 Test 7: Caché de consultas")
+
+        cache = EmbeddingCache(max_entries=2)
+        cache.put_embedding("¿Cuántos días de vacaciones hay?", [1.0, 0.0])
+
+        # Normalización de la clave (mayúsculas y espacios)
+        self.assertIsNotNone(cache.get_embedding("  ¿CUÁNTOS días de vacaciones hay? "))
+
+        # Desalojo LRU
+        cache.put_embedding("pregunta 2", [0.0, 1.0])
+        cache.put_embedding("pregunta 3", [0.5, 0.5])
+        self.assertIsNone(cache.get_embedding("¿Cuántos días de vacaciones hay?"))
+
+        print("✅ Caché de consultas funcionando")
+
+    def test_09_streaming_chunking(self):
+        """Test: División en fragmentos en streaming"""
+        print("\n🧪 Test 9: Fragmentos en streaming")
+
+        create_sample_documents()
+        text_chunker = TextChunker()
+        chunks = text_chunker.split_documents(DocumentProcessor.load_documents_from_directory("sample_docs"))
+
+        streamed = text_chunker.split_documents(
+            DocumentProcessor.iter_documents_from_directory("sample_docs")
+        )
+
+        self.assertEqual(len(streamed), len(chunks), "El streaming produjo fragmentos distintos")
+        self.assertEqual([c.metadata["chunk_id"] for c in streamed], list(range(len(streamed))))
+        self.assertTrue(
+            all(c.metadata["preview"] == c.page_content[:200] for c in streamed),
+            "Fragmentos sin vista previa"
+        )
+
+        print(f"✅ {len(streamed)} fragmentos generados en streaming")
+
+    def test_10_response_cache(self):
+        """Test: Caché semántica de respuestas"""
+        print("\n🧪 Test 10: Caché de respuestas")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_path = os.path.join(tmp_dir, "qa_cache.json")
+            cache = ResponseCache(cache_path, similarity_threshold=0.95)
+            cache.configure({"search_type": "similarity", "k": 3})
+            cache.add([1.0, 0.0], {"answer": "15 días"})
+
+            # Coincidencia semántica por similitud coseno
+            self.assertEqual(cache.lookup([0.99, 0.01])["answer"], "15 días")
+            self.assertIsNone(cache.lookup([0.0, 1.0]))
+
+            # Persistencia en disco (solo al hacer flush)
+            self.assertEqual(len(ResponseCache(cache_path)), 0, "Se escribió antes del flush")
+            cache.flush()
+            reloaded = ResponseCache(cache_path, similarity_threshold=0.95)
+            self.assertEqual(len(reloaded), 1, "La caché no se persistió")
+
+            # Otra configuración del recuperador invalida las respuestas
+            self.assertFalse(reloaded.configure({"search_type": "similarity", "k": 3}))
+            self.assertTrue(reloaded.configure({"search_type": "mmr", "k": 7}))
+            self.assertEqual(len(reloaded), 0, "La caché no se invalidó")
+
+            # Un archivo corrupto no impide crear la caché
+            Path(cache_path).write_text('{"config": null, "entries": [{"embed', encoding="utf-8")
+            self.assertEqual(len(ResponseCache(cache_path)), 0)
+
+        print("✅ Caché de respuestas funcionando")
+
+    @unittest.skipUnless(importlib.util.find_spec("faiss"), "faiss-cpu no instalado")
+    def test_11_quantized_incremental_index(self):
+        """Test: Índice int8 construido de forma incremental"""
+        print("\n🧪 Test 11: Índice cuantizado incremental")
+
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((300, 384)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = [str(i) for i in range(len(vectors))]
+        texts = [f"fragmento {i}" for i in range(len(vectors))]
+        metadatas = [{} for _ in texts]
+
+        exact = FAISSVectorStore(None, 384)
+        original = vectors * 2
+        exact.add_embeddings(ids, texts, original, metadatas)
+        self.assertTrue(np.array_equal(original, vectors * 2), "Se modificó el arreglo del llamador")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Primero un lote pequeño (como test_03) y luego el resto, recargando desde disco
+            quantized = FAISSVectorStore(None, 384, persist_directory=tmp_dir, quantize=True)
+            quantized.add_embeddings(ids[:5], texts[:5], vectors[:5], metadatas[:5])
+            quantized = FAISSVectorStore(None, 384, persist_directory=tmp_dir, quantize=True)
+            quantized.add_embeddings(ids[5:], texts[5:], vectors[5:], metadatas[5:])
+
+            _, _, stored = quantized.get_all()
+            # Rango fijo [-1, 1]: el error máximo es medio paso de cuantización (1/255)
+            self.assertLess(float(np.abs(stored - vectors).max()), 0.005, "Vectores recortados")
+
+            queries = rng.standard_normal((20, 384)).astype(np.float32)
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+            hits = 0
+            for query in queries:
+                _, expected = exact._search_by_vector(query, 7)
+                _, found = quantized._search_by_vector(query, 7)
+                hits += len(set(expected.tolist()) & set(found.tolist()))
+
+        recall = hits / (len(queries) * 7)
+        self.assertGreaterEqual(recall, 0.9, f"Recall@7 muy bajo: {recall:.2f}")
+
+        print(f"✅ Índice cuantizado incremental: recall@7 = {recall:.2f}")
+
+    @unittest.skipUnless(importlib.util.find_spec("faiss"), "faiss-cpu no instalado")
+    def test_12_faiss_embedding_model_check(self):
+        """Test: Índice FAISS persistido con otro modelo de embeddings"""
+        print("\n🧪 Test 12: Compatibilidad del índice FAISS")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = FAISSVectorStore(None, 2, persist_directory=tmp_dir, embedding_model="modelo-a")
+            store.add_embeddings(["1"], ["fragmento"], [[1.0, 0.0]], [{}])
+
+            # Mismo modelo: se reutiliza; mismas dimensiones pero otro modelo: se descarta
+            self.assertEqual(FAISSVectorStore(None, 2, persist_directory=tmp_dir,
+                                              embedding_model="modelo-a").index.ntotal, 1)
+            self.assertEqual(FAISSVectorStore(None, 2, persist_directory=tmp_dir,
+                                              embedding_model="modelo-b").index.ntotal, 0)
+
+        print("✅ Índice de otro modelo descartado")
+
+    @unittest.skipUnless(importlib.util.find_spec("faiss"), "faiss-cpu no instalado")
+    def test_13_faiss_backend(self):
+        """Test: Backend FAISS (persistencia, recarga, similitud y MMR)"""
+        print("\n🧪 Test 13: Backend FAISS")
+
+        embeddings = CachedEmbeddings(KeywordEmbeddings(), EmbeddingCache())
+        dimensions = len(KeywordEmbeddings.VOCABULARY)
+        texts = ["vacaciones días", "vacaciones días", "código python días"]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = FAISSVectorStore(embeddings, dimensions, persist_directory=tmp_dir)
+            store.add_texts(texts, [{"chunk_id": i} for i in range(len(texts))], ids=["a", "b", "c"])
+
+            reloaded = FAISSVectorStore(embeddings, dimensions, persist_directory=tmp_dir)
+            self.assertEqual(reloaded.get_existing_ids(["a", "b", "c", "d"]), {"a", "b", "c"})
+
+            # Puntuaciones de relevancia = similitud coseno, ordenadas de mayor a menor
+            results = reloaded.similarity_search_with_relevance_scores("vacaciones", k=3)
+            scores = [score for _, score in results]
+            self.assertEqual(results[0][0].page_content, "vacaciones días")
+            self.assertAlmostEqual(scores[0], 2 ** -0.5, places=4)
+            self.assertEqual(scores, sorted(scores, reverse=True), "Resultados no ordenados")
+
+            # MMR evita devolver el fragmento duplicado
+            diverse = reloaded.max_marginal_relevance_search("vacaciones", k=2, fetch_k=3, lambda_mult=0.25)
+            self.assertEqual({doc.page_content for doc in diverse}, set(texts))
+
+            # Eliminación de fragmentos obsoletos
+            self.assertTrue(reloaded.delete(["c"]))
+            self.assertEqual(reloaded.get_ids(), ["a", "b"])
+            self.assertEqual(reloaded.index.ntotal, 2)
+
+        print("✅ Backend FAISS funcionando")
+
+    def test_15_embedding_batches(self):
+        """Test: Agrupación de textos en lotes para generar embeddings"""
+        print("\n🧪 Test 15: Lotes de embeddings")
+
+        texts = ["a", "b", "c", "d", "e"]
+
+        # Presupuesto de tokens: un texto que no cabe va solo en su lote
+        batches = RAGSystem._batch_by_tokens(texts, max_tokens=8000,
+                                             token_counts=[3000, 3000, 3000, 9000, 10])
+        self.assertEqual(batches, [["a", "b"], ["c"], ["d"], ["e"]])
+
+        # Lotes de tamaño fijo (embeddings locales, sin tokenizador)
+        self.assertEqual(RAGSystem._batch_by_count(texts, batch_size=2), [["a", "b"], ["c", "d"], ["e"]])
+        self.assertEqual(RAGSystem._batch_by_count([]), [])
+
+        print("✅ Lotes de embeddings correctos")
+
+    def test_16_loop_local_transport(self):
+        """Test: Pool de conexiones HTTP por event loop"""
+        print("\n🧪 Test 16: Conexiones por event loop")
+
+        transport = _LoopLocalTransport()
+
+        async def pools_in_loop():
+            first = transport._current_transport()
+            second = transport._current_transport()
+            await transport.aclose()
+            return first, second, len(transport._transports)
+
+        # Un solo pool por loop, cerrado al terminar; cada asyncio.run abre uno nuevo
+        first, second, remaining = asyncio.run(pools_in_loop())
+        self.assertIs(first, second)
+        self.assertEqual(remaining, 0, "El pool no se cerró")
+        self.assertIsNot(asyncio.run(pools_in_loop())[0], first)
+
+        print("✅ Un pool de conexiones por event loop")
+
+    def test_17_async_batch_query(self):
+        """Test: Consultas concurrentes con abatch_query"""
+        print("\n🧪 Test 17: Consultas asíncronas por lotes")
+
+        # Las primeras preguntas tardan más: terminan en orden inverso al de entrada
+        questions = [f"pregunta {i}" for i in range(6)] + ["pregunta que falla"]
+        chain = StubQAChain({question: 0.01 * (len(questions) - i) for i, question in enumerate(questions)})
+
+        # Sistema sin inicializar (sin API key): solo se usan la cadena y la caché
+        rag_system = RAGSystem.__new__(RAGSystem)
+        rag_system.response_cache = None
+        rag_system.qa_chain = chain
+
+        results = asyncio.run(rag_system.abatch_query(questions, max_concurrency=2))
+
+        self.assertEqual([result["question"] for result in results], questions, "Orden incorrecto")
+        self.assertEqual(chain.max_active, 2, "No se respetó max_concurrency")
+        self.assertTrue(results[-1].get("error"), "El error no se convirtió en respuesta")
+        self.assertTrue(all("error" not in result for result in results[:-1]))
+        self.assertEqual(results[0]["answer"], "respuesta a pregunta 0")
+
+        print(f"✅ {len(questions)} consultas concurrentes en orden, con un error aislado")
+
+
+    def test_18_find_files(self):
+        """Test: Búsqueda de archivos en un directorio"""
+        print("\n🧪 Test 18: Búsqueda de archivos")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ["b.txt", "A.PDF", "c.md"]:
+                Path(tmp_dir, name).write_text("contenido", encoding="utf-8")
+            Path(tmp_dir, "x.txt").mkdir()
+
+            # Extensión sin distinguir mayúsculas, sin directorios y en orden estable
+            found = DocumentProcessor._find_files(tmp_dir)
+            self.assertEqual([path.name for path in found], ["A.PDF", "b.txt"])
+
+            self.assertEqual(DocumentProcessor._find_files(os.path.join(tmp_dir, "no_existe")), [])
+
+        print("✅ Archivos encontrados en orden")
+
 
 def run_performance_test():
     """Ejecuta test de rendimiento del sistema"""
@@ -157,8 +491,9 @@ def run_performance_test():
     start_time = time.time()
 
     try:
-        # Inicializar sistema
-        rag_system = RAGSystem()
+        # Inicializar sistema (índice temporal, sin podar ./chroma_db)
+        tmp_dir = tempfile.TemporaryDirectory()
+        rag_system = RAGSystem(persist_directory=tmp_dir.name)
         create_sample_documents()
 
         # Procesar documentos
@@ -260,4 +595,4 @@ if __name__ == "__main__":
     # Ejecutar test de integración
     run_integration_test()
 
-    print("\n✅ Todos los tests completados!")
\ No newline at end of file
+    print("\n✅ Todos los tests completados!")